@@ -0,0 +1,26 @@
+import gzip
+import json
+
+# orjson is optional, the stdlib json module is used if it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def encode_body(data, compress):
+    body = dumps(data)
+    headers = {"Content-Type": "application/json;charset=UTF-8"}
+    if compress:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
@@ -0,0 +1,24 @@
+import fcntl
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+    def acquire(self):
+        # Lock is held until the process ends, the OS releases it if the leader dies
+        if self.file is not None:
+            return True
+        file = open(self.path, 'a')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        return True
+
+class StaticLock:
+    def __init__(self, leader):
+        self.leader = leader
+    def acquire(self):
+        return self.leader
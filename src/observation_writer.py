@@ -0,0 +1,76 @@
+import re
+import queue
+import threading
+import json_codec
+
+OBSERVATION_LINK_PATTERN = re.compile(r'Observations\(([^)]+)\)')
+
+def write_stream(observations, post, queue_size, batch_size):
+    # Posts the observations in a writer thread, raises the first failed write after all are consumed
+    observationQueue = queue.Queue(maxsize=queue_size)
+    errors = []
+    writer = threading.Thread(target=write_observations, args=(observationQueue, errors, post, batch_size))
+    writer.start()
+    try:
+        for observation in observations:
+            observationQueue.put(observation)
+            if len(errors) > 0:
+                raise errors[0]
+    finally:
+        observationQueue.put(None)
+        writer.join()
+    if len(errors) > 0:
+        raise errors[0]
+
+def write_observations(observationQueue, errors, post, batch_size):
+    # Consumes the queue until None, after an error the queue is only drained
+    batch = []
+    observation = observationQueue.get()
+    while observation is not None:
+        batch.append(observation)
+        if len(batch) >= batch_size:
+            post_safe(batch, errors, post)
+            batch = []
+        observation = observationQueue.get()
+    post_safe(batch, errors, post)
+
+def post_safe(observations, errors, post):
+    if len(errors) > 0 or len(observations) == 0:
+        return
+    try:
+        post(observations)
+    except Exception as e:
+        errors.append(e)
+
+def check_batch_response(r):
+    if (r.status_code != 200):
+        print("Could not save Observations")
+        print(str(r.status_code)+": "+r.text)
+        raise Exception("Could not save Observations ("+str(r.status_code)+")")
+    json_response = json_codec.loads(r.content)
+    failed = 0
+    if 'responses' in json_response:
+        print(str(len(json_response['responses'])) + ' Responses')
+        for response in json_response['responses']:
+            if response['status'] != 200 and response['status'] != 201:
+                print(str(response['id']) + " (" + str(response['status']) + "): " + str(response['body']))
+                failed += 1
+    if failed > 0:
+        raise Exception(str(failed) + " Observations could not be saved")
+
+def check_data_array_response(r, entries):
+    if (r.status_code != 201):
+        print("Could not save Observations")
+        print(str(r.status_code)+": "+r.text)
+        raise Exception("Could not save Observations ("+str(r.status_code)+")")
+    # One self link or error per entry, in request order
+    links = json_codec.loads(r.content)
+    created = 0
+    for observation, link in zip(entries, links):
+        if OBSERVATION_LINK_PATTERN.search(link) is None:
+            print(observation['id'] + ": " + link)
+        else:
+            created += 1
+    print(str(created) + ' Created')
+    if created < len(entries):
+        raise Exception(str(len(entries) - created) + " Observations could not be saved")
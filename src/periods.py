@@ -0,0 +1,115 @@
+import math
+import datetime
+import pytz
+
+# Interval definitions
+INTERVAL_5_MIN = "5-Min"
+INTERVAL_1_HOUR = "1-Stunde"
+INTERVAL_1_DAY = "1-Tag"
+INTERVAL_1_WEEK = "1-Woche"
+INTERVAL_1_MONTH = "1-Monat"
+INTERVAL_1_YEAR = "1-Jahr"
+
+INTERVAL_5_MIN_DURATION = datetime.timedelta(minutes=5)
+INTERVAL_1_HOUR_DURATION = datetime.timedelta(hours=1)
+INTERVAL_1_DAY_DURATION = datetime.timedelta(days=1)
+INTERVAL_1_WEEK_DURATION = datetime.timedelta(days=7)
+
+# Import order, finer intervals first
+INTERVAL_RANK = {
+    INTERVAL_5_MIN: 0,
+    INTERVAL_1_HOUR: 1,
+    INTERVAL_1_DAY: 2,
+    INTERVAL_1_WEEK: 3,
+    INTERVAL_1_MONTH: 4,
+    INTERVAL_1_YEAR: 5
+}
+
+TIMEZONE = pytz.timezone("Europe/Berlin")
+UTC = pytz.utc
+
+def startOfStep(time, step):
+    time = time.replace(second = 0, microsecond = 0)
+    if step == INTERVAL_5_MIN:
+        return time.replace(minute=math.floor(time.minute/5)*5)
+    if step == INTERVAL_1_HOUR:
+        return time.replace(minute=0)
+    if step == INTERVAL_1_DAY:
+        return TIMEZONE.localize(time.replace(hour=0, minute=0, tzinfo=None))
+    if step == INTERVAL_1_WEEK:
+        return TIMEZONE.localize((time - datetime.timedelta(days=time.weekday())).replace(hour=0, minute=0, tzinfo=None))
+    if step == INTERVAL_1_MONTH:
+        return TIMEZONE.localize(time.replace(day = 1, hour=0, minute=0, tzinfo=None))
+    if step == INTERVAL_1_YEAR:
+        return TIMEZONE.localize(time.replace(month = 1, day = 1, hour=0, minute=0, tzinfo=None))
+    return None
+
+def getEndTime(start, step):
+    if step == INTERVAL_5_MIN:
+        return start + INTERVAL_5_MIN_DURATION
+    if step == INTERVAL_1_HOUR:
+        return start + INTERVAL_1_HOUR_DURATION
+    if step == INTERVAL_1_DAY:
+        return start + INTERVAL_1_DAY_DURATION
+    if step == INTERVAL_1_WEEK:
+        return start + INTERVAL_1_WEEK_DURATION
+    if step == INTERVAL_1_MONTH:
+        if start.month < 12:
+            return start.replace(month=start.month+1)
+        else:
+            return start.replace(year=start.year+1, month=1)
+    if step == INTERVAL_1_YEAR:
+        return start.replace(year=start.year+1)
+    return None
+
+def getObservationsEnd(lastTime, interval):
+    # One bucket margin after the last bucket of the range
+    return getEndTime(getEndTime(startOfStep(lastTime, interval), interval), interval)
+
+def split_range(start, end, intervals):
+    # Ranges follow the buckets of the coarsest interval, intervals up to one day are split into days.
+    # Range bounds are UTC midnights, like the bucketing of the API data.
+    step = max(intervals, key=lambda interval: INTERVAL_RANK[interval])
+    if INTERVAL_RANK[step] < INTERVAL_RANK[INTERVAL_1_DAY]:
+        step = INTERVAL_1_DAY
+    ranges = []
+    rangeStart = start
+    rangeEnd = UTC.localize(getEndTime(startOfStep(rangeStart, step), step).replace(tzinfo=None))
+    while rangeEnd < end:
+        ranges.append((rangeStart, rangeEnd))
+        rangeStart = rangeEnd
+        rangeEnd = UTC.localize(getEndTime(startOfStep(rangeStart, step), step).replace(tzinfo=None))
+    ranges.append((rangeStart, end))
+    return ranges
+
+def getFinalizedUntil(datastream):
+    if 'finalizedUntil' in datastream['properties']:
+        return UTC.localize(datetime.datetime.strptime(datastream['properties']['finalizedUntil'], "%Y-%m-%dT%H:%M:%SZ"))
+    return None
+
+def getOpenBegin(datastream, start, reopen, extend):
+    begin = startOfStep(start, datastream['properties']["periodLength"])
+    finalizedUntil = getFinalizedUntil(datastream)
+    if reopen or finalizedUntil is None:
+        return begin
+    # Finalized buckets are skipped. The first range of a run also covers the open buckets
+    # between the last finalized one and its start (e.g. after midnight or an outage).
+    if finalizedUntil > begin or extend:
+        return finalizedUntil
+    return begin
+
+def getNewFinalizedUntil(datastream, begin, end, settled, extend):
+    interval = datastream['properties']["periodLength"]
+    finalizedUntil = getFinalizedUntil(datastream)
+    # Buckets starting before the first open bucket have ended before the settle time
+    # and, for a range ending before now, are completely covered by this range
+    newFinalizedUntil = min(startOfStep(settled, interval), startOfStep(end.astimezone(UTC), interval))
+    # Finalize only if this range covered every bucket since the last finalized one.
+    # Without a marker only the first range of a run starts at the run's start, later
+    # ranges run before it and must not skip the buckets in between.
+    if finalizedUntil is None:
+        if extend and begin <= newFinalizedUntil:
+            return newFinalizedUntil
+    elif begin <= finalizedUntil and newFinalizedUntil > finalizedUntil:
+        return newFinalizedUntil
+    return None
@@ -0,0 +1,96 @@
+import time
+import threading
+from requests.adapters import HTTPAdapter
+
+OVERLOAD_STATUS = (429, 503)
+
+class TokenBucket:
+    def __init__(self, rate):
+        # rate 0 disables the bucket
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AdaptiveLimiter:
+    def __init__(self, read_rate, write_rate, max_concurrency, target_latency):
+        self.buckets = {
+            "read": TokenBucket(read_rate),
+            "write": TokenBucket(write_rate)
+        }
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.decreased = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, kind):
+        self.buckets[kind].take()
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, latency, overloaded):
+        with self.condition:
+            self.active -= 1
+            now = time.monotonic()
+            if overloaded or latency > self.target_latency:
+                # Multiplicative decrease, at most once per target latency
+                if now - self.decreased > self.target_latency:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased = now
+                    print("FROST concurrency limit: " + str(int(self.limit)))
+            else:
+                # Additive increase, about one per limit successful requests
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self, limiter, retries=3):
+        super().__init__(pool_maxsize=limiter.max_concurrency)
+        self.limiter = limiter
+        self.retries = retries
+
+    def send(self, request, **kwargs):
+        kind = "read" if request.method in ("GET", "HEAD") else "write"
+        attempt = 0
+        while True:
+            self.limiter.acquire(kind)
+            start = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception:
+                self.limiter.release(time.monotonic() - start, True)
+                raise
+            overloaded = response.status_code in OVERLOAD_STATUS
+            self.limiter.release(time.monotonic() - start, overloaded)
+            if not overloaded or attempt >= self.retries:
+                return response
+            attempt += 1
+            wait = retry_after(response, attempt)
+            print("FROST overloaded (" + str(response.status_code) + "), retry in " + str(wait) + "s")
+            response.close()
+            time.sleep(wait)
+
+def retry_after(response, attempt):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return 2 ** attempt
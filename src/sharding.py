@@ -0,0 +1,11 @@
+import zlib
+
+def check_shard_config(shard_count, shard_index):
+    if shard_count < 1:
+        raise Exception('SHARD_COUNT must be at least 1, got ' + str(shard_count))
+    if shard_index < 0 or shard_index >= shard_count:
+        raise Exception('SHARD_INDEX must be between 0 and ' + str(shard_count - 1) + ', got ' + str(shard_index))
+
+def shard_of(cameraId, shard_count):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(cameraId.encode('utf-8')) % shard_count
@@ -1,38 +1,76 @@
-import math
 import json
 import requests
 import datetime
-import pytz
 import os
+import re
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 from keycloak import KeycloakOpenID
 from bearer_auth import BearerAuth
+from leader_lock import FileLock, StaticLock
+from sharding import check_shard_config, shard_of
+import transport_recorder
+import json_codec
+from rate_limiter import AdaptiveLimiter, RateLimitedAdapter
+from work_queue import WorkQueue, WorkRun
+from observation_writer import write_stream, check_batch_response, check_data_array_response
+from periods import INTERVAL_5_MIN, INTERVAL_1_HOUR, INTERVAL_1_DAY, INTERVAL_1_WEEK, INTERVAL_1_MONTH, INTERVAL_1_YEAR, INTERVAL_RANK, INTERVAL_1_DAY_DURATION, TIMEZONE, UTC
+from periods import startOfStep, getEndTime, getObservationsEnd, split_range, getOpenBegin, getNewFinalizedUntil
 
 # FROST URLs
 FROST_BASE_URL = os.environ.get('FROST_SERVER')
 FROST_THINGS_WITH_DATASTREAMS = FROST_BASE_URL+"/Things?$expand=Datastreams,Locations"
 FROST_OBSERVATIONS = FROST_BASE_URL+"/Datastreams(<DATASTREAM_ID>)/Observations?$filter=not phenomenonTime lt <STARTTIME>&$count=false"
+FROST_OBSERVATIONS_RANGE = FROST_BASE_URL+"/Datastreams(<DATASTREAM_ID>)/Observations?$filter=not phenomenonTime lt <STARTTIME> and phenomenonTime lt <ENDTIME>&$count=false"
 POST_URL = FROST_BASE_URL+"/$batch"
+CREATE_OBSERVATIONS_URL = FROST_BASE_URL+"/CreateObservations"
+
+# Number of pages loaded in parallel, 0 follows @iot.nextLink page by page
+FROST_PAGE_WORKERS = int(os.environ.get('FROST_PAGE_WORKERS', '0'))
+
+# Send gzip compressed $batch bodies, only if the server accepts them
+FROST_GZIP_REQUESTS = os.environ.get('FROST_GZIP_REQUESTS', 'false').lower() == 'true'
+
+# Create new Observations via the DataArray extension, changed values are still patched via $batch
+FROST_DATA_ARRAY = os.environ.get('FROST_DATA_ARRAY', 'false').lower() == 'true'
+DATASTREAM_OBSERVATIONS_PATTERN = re.compile(r'Datastreams\(([^)]+)\)/Observations')
 
 FROST_USER = os.environ.get('FROST_USER')
 FROST_PASS = os.environ.get('FROST_PASSWORD')
 frost_auth=(FROST_USER,FROST_PASS)
 
+# Limits for all FROST requests, rates in requests per second (0 = unlimited)
+FROST_READ_RATE = float(os.environ.get('FROST_READ_RATE', '0'))
+FROST_WRITE_RATE = float(os.environ.get('FROST_WRITE_RATE', '0'))
+FROST_MAX_CONCURRENCY = int(os.environ.get('FROST_MAX_CONCURRENCY', '8'))
+FROST_TARGET_LATENCY = float(os.environ.get('FROST_TARGET_LATENCY', '5'))
+
+frost_limiter = AdaptiveLimiter(FROST_READ_RATE, FROST_WRITE_RATE, FROST_MAX_CONCURRENCY, FROST_TARGET_LATENCY)
+frost = requests.Session()
+frost.mount(FROST_BASE_URL, RateLimitedAdapter(frost_limiter))
+
 CAMDATA_URL = os.environ.get('CAMDATA_URL')
 CAMDATA_AUTH_URL = os.environ.get('CAMDATA_AUTH_URL')
 CAMDATA_REALM = os.environ.get('CAMDATA_REALM')
 CAMDATA_CLIENT_ID = os.environ.get('CAMDATA_CLIENT_ID')
 CAMDATA_CLIENT_SECRET = os.environ.get('CAMDATA_CLIENT_SECRET')
 
-API_URL = "http://20.218.113.185/api/thermicam?fromDay=<FROM>>&toDay=<TO>&fromHour=0&toHour=23&fromMinute=0&toMinute=59&ids=<CAM_ID>"
-# Interval definitions
-INTERVAL_5_MIN = "5-Min"
-INTERVAL_1_HOUR = "1-Stunde"
-INTERVAL_1_DAY = "1-Tag"
-INTERVAL_1_WEEK = "1-Woche"
-INTERVAL_1_MONTH = "1-Monat"
-INTERVAL_1_YEAR = "1-Jahr"
+# Sharding - each instance imports only the cameras of its shard
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', '1'))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', '0'))
+check_shard_config(SHARD_COUNT, SHARD_INDEX)
+LEADER_LOCK_FILE = os.environ.get('LEADER_LOCK_FILE')
 
+# Record/replay of all HTTP exchanges
+TRANSPORT_MODE = os.environ.get('TRANSPORT_MODE')
+TRANSPORT_FILE = os.environ.get('TRANSPORT_FILE', 'transport.jsonl.gz')
+TRANSPORT_LATENCY = os.environ.get('TRANSPORT_LATENCY', 'false').lower() == 'true'
+
+API_URL = "http://20.218.113.185/api/thermicam?fromDay=<FROM>>&toDay=<TO>&fromHour=0&toHour=23&fromMinute=0&toMinute=59&ids=<CAM_ID>"
+# Interval labels
 INTERVAL_5_MIN_LABEL = "5 Minuten"
 INTERVAL_1_HOUR_LABEL = "Stunde"
 INTERVAL_1_DAY_LABEL = "Tag"
@@ -40,15 +78,20 @@ INTERVAL_1_WEEK_LABEL = "Woche"
 INTERVAL_1_MONTH_LABEL = "Monat"
 INTERVAL_1_YEAR_LABEL = "Jahr"
 
-INTERVAL_5_MIN_DURATION = datetime.timedelta(minutes=5)
-INTERVAL_1_HOUR_DURATION = datetime.timedelta(hours=1)
-INTERVAL_1_DAY_DURATION = datetime.timedelta(days=1)
-INTERVAL_1_WEEK_DURATION = datetime.timedelta(days=7)
+TIMEOUT = 180
+
+# Observations waiting for the writer, aggregation blocks while the queue is full
+OBSERVATION_QUEUE_SIZE = int(os.environ.get('OBSERVATION_QUEUE_SIZE', '2000'))
+POST_BATCH_SIZE = 500
 
-TIMEZONE = pytz.timezone("Europe/Berlin")
-UTC = pytz.utc
+# Buckets ending longer ago than the settle time are finalized and not read or written again
+SETTLE_TIME = datetime.timedelta(hours=float(os.environ.get('SETTLE_TIME_HOURS', '4')))
+BACKFILL_START = os.environ.get('BACKFILL_START')
 
-TIMEOUT = 180
+# Work queue - priority is the interval rank plus one per day of data age, waiting items gain PRIORITY_AGING per hour
+PRIORITY_AGING = float(os.environ.get('PRIORITY_AGING', '1'))
+RUN_DEADLINE = datetime.timedelta(minutes=float(os.environ.get('RUN_DEADLINE_MINUTES', '50')))
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', '2'))
 
 mq_dummy_zone = {
     "zoneId" : "MQ",
@@ -99,6 +142,16 @@ sensor = None
 things = None
 
 sched = BlockingScheduler()
+work_queue = WorkQueue(PRIORITY_AGING / 3600)
+
+# Only the leader updates ObservedProperties, Sensor and Things
+if LEADER_LOCK_FILE:
+    leader_lock = FileLock(LEADER_LOCK_FILE)
+else:
+    leader_lock = StaticLock(SHARD_INDEX == 0)
+
+if TRANSPORT_MODE:
+    transport_recorder.install(TRANSPORT_MODE, TRANSPORT_FILE, TRANSPORT_LATENCY)
 
 # Configure client
 keycloak_openid = KeycloakOpenID(server_url=CAMDATA_AUTH_URL,
@@ -112,6 +165,12 @@ def getToken():
 
     return BearerAuth(token['access_token'])
 
+def is_leader():
+    return leader_lock.acquire()
+
+def is_own_cam(cameraId):
+    return shard_of(cameraId, SHARD_COUNT) == SHARD_INDEX
+
 def load_master_data():
     global cams
     q_res = requests.get(CAMDATA_URL, timeout=TIMEOUT)
@@ -124,8 +183,6 @@ def load_master_data():
 
 def init():
     load_master_data()
-    init_observedProperty()
-    init_sensor()
     init_things()
     #load_hourly_data()
 
@@ -144,7 +201,7 @@ def init_observedProperty():
         observedPropertySpeed = create_observedProperty('Geschwindigkeit')
 
 def load_observedProperty(name):
-    q_res = requests.get(FROST_BASE_URL+'/ObservedProperties', auth=frost_auth, timeout=TIMEOUT)
+    q_res = frost.get(FROST_BASE_URL+'/ObservedProperties', auth=frost_auth, timeout=TIMEOUT)
     if (q_res.status_code == 200):
         json_response = q_res.json()
         if 'value' in json_response:
@@ -164,11 +221,11 @@ def create_observedProperty(name):
         "definition": "http://www.opengis.net/def/observationType/OGC-OM/2.0/OM_Measurement"
     }
 
-    q_res = requests.post(FROST_BASE_URL+'/ObservedProperties', auth=frost_auth, json=q_data, timeout=TIMEOUT)
+    q_res = frost.post(FROST_BASE_URL+'/ObservedProperties', auth=frost_auth, json=q_data, timeout=TIMEOUT)
     if (q_res.status_code != 201):
         print("Could not create ObservedProperty for '"+name+"'")
     else:
-        q_data = requests.get(q_res.headers['location'], timeout=TIMEOUT)
+        q_data = frost.get(q_res.headers['location'], timeout=TIMEOUT)
         print(name+'-id: ' + str(q_data.json()['@iot.id']))
         return q_data.json()['@iot.id']
 
@@ -181,7 +238,7 @@ def init_sensor():
         sensor = create_sensor()
 
 def load_sensor():
-    q_res = requests.get(FROST_BASE_URL+'/Sensors', auth=frost_auth, timeout=TIMEOUT)
+    q_res = frost.get(FROST_BASE_URL+'/Sensors', auth=frost_auth, timeout=TIMEOUT)
     if (q_res.status_code == 200):
         json_response = q_res.json()
         if 'value' in json_response:
@@ -202,37 +259,29 @@ def create_sensor():
         "metadata" : "https://www.flir.de/products/thermicam-ai/?model=10-7736"
     }
 
-    q_res = requests.post(FROST_BASE_URL+'/Sensors', auth=frost_auth, json=sensor_data, timeout=TIMEOUT)
+    q_res = frost.post(FROST_BASE_URL+'/Sensors', auth=frost_auth, json=sensor_data, timeout=TIMEOUT)
     if (q_res.status_code != 201):
         print("Could not create Sensor for 'ThermiCam AI'")
     else:
-        q_data = requests.get(q_res.headers['location'], timeout=TIMEOUT)
+        q_data = frost.get(q_res.headers['location'], timeout=TIMEOUT)
         print('Sensor-id: ' + str(q_data.json()['@iot.id']))
         return q_data.json()['@iot.id']
 
 def load_things():
     print(FROST_THINGS_WITH_DATASTREAMS)
+    url = paged_url(FROST_THINGS_WITH_DATASTREAMS)
     results = []
     try:
-        r = requests.get(FROST_THINGS_WITH_DATASTREAMS, timeout=TIMEOUT)
+        r = frost.get(first_page_url(url), timeout=TIMEOUT)
     except:
-        r = requests.get(FROST_THINGS_WITH_DATASTREAMS, timeout=TIMEOUT)
+        r = frost.get(first_page_url(url), timeout=TIMEOUT)
     if (r.status_code == 200):
-        json_response = r.json()
+        json_response = json_codec.loads(r.content)
         if 'value' in json_response:
             results += json_response['value']
+            results += load_next_pages(url, json_response)
         else:
             results.append(json_response)
-        while '@iot.nextLink' in json_response:
-            try:
-                r = requests.get(json_response['@iot.nextLink'], timeout=TIMEOUT)
-            except:
-                r = requests.get(json_response['@iot.nextLink'], timeout=TIMEOUT)
-            if r.status_code != 200:
-                print(str(r.status_code)+": "+r.json()['message'])
-                raise Exception("Could not load Data from Frost")
-            json_response = r.json()
-            results += json_response['value']
     else:
         print("Error "+str(r.status_code))
         print(r.text)
@@ -241,27 +290,60 @@ def load_things():
         if "Datastreams@iot.nextLink" in thing:
             nextLink = thing['Datastreams@iot.nextLink']
             while nextLink != None:
-                try:
-                    r = requests.get(nextLink, timeout=TIMEOUT)
-                except:
-                    r = requests.get(nextLink, timeout=TIMEOUT)
-                if r.status_code != 200:
-                    print(str(r.status_code)+": "+r.json()['message'])
-                    raise Exception("Could not load Data from Frost")
-                json_response = r.json()
+                json_response = load_page(nextLink)
                 thing["Datastreams"] += json_response['value']
                 nextLink = json_response['@iot.nextLink'] if '@iot.nextLink' in json_response else None
 
     return results
 
+def paged_url(url):
+    if FROST_PAGE_WORKERS > 1:
+        return url.replace('&$count=false', '') + '&$orderby=id asc'
+    return url
+
+def first_page_url(url):
+    # Only the first page asks for the count, the following pages are planned from it
+    if FROST_PAGE_WORKERS > 1:
+        return url + '&$count=true'
+    return url
+
+def load_page(url):
+    try:
+        r = frost.get(url, timeout=TIMEOUT)
+    except:
+        r = frost.get(url, timeout=TIMEOUT)
+    if r.status_code != 200:
+        print(str(r.status_code)+": "+r.text)
+        raise Exception("Could not load Data from Frost")
+    return json_codec.loads(r.content)
+
+def load_next_pages(url, json_response):
+    if FROST_PAGE_WORKERS > 1 and '@iot.nextLink' in json_response and '@iot.count' in json_response and len(json_response['value']) > 0:
+        # Plan all remaining pages from the count and load them in parallel
+        page_size = len(json_response['value'])
+        page_urls = [url+'&$top='+str(page_size)+'&$skip='+str(skip) for skip in range(page_size, json_response['@iot.count'], page_size)]
+        with ThreadPoolExecutor(max_workers=FROST_PAGE_WORKERS) as executor:
+            pages = executor.map(load_page, page_urls)
+            return [value for page in pages for value in page['value']]
+    results = []
+    while '@iot.nextLink' in json_response:
+        json_response = load_page(json_response['@iot.nextLink'])
+        results += json_response['value']
+    return results
+
 def init_things():
     global things, cams
     # load things
     things = load_things()
     # Update
-    update_things(things, cams)
+    if is_leader():
+        if sensor is None:
+            init_observedProperty()
+            init_sensor()
+        update_things(things, cams)
     # Reload changed things
     #things = load_things()
+    things = [thing for thing in things if is_own_cam(thing['properties']['cameraId'])]
 
 def update_things(things, cams):
     for cam in cams:
@@ -329,7 +411,7 @@ def create_thing(cam):
 
     # Store Thing in Frost-Server
     print(json.dumps(thing, indent=4, sort_keys=True))
-    q_res = requests.post(FROST_BASE_URL + '/Things', auth=frost_auth, json=thing, timeout=TIMEOUT)
+    q_res = frost.post(FROST_BASE_URL + '/Things', auth=frost_auth, json=thing, timeout=TIMEOUT)
     if (q_res.status_code != 201):
         print("Could not create Thing " + thing['name'])
         print(q_res.text)
@@ -428,7 +510,7 @@ def create_missing_datastreams(thing, cam):
             datastream["Thing"] = {"@iot.id": thing["@iot.id"]}
             #print(json.dumps(datastream, indent=4, sort_keys=True))
 
-            q_res = requests.post(FROST_BASE_URL + '/Datastreams', auth=frost_auth, json=datastream, timeout=TIMEOUT)
+            q_res = frost.post(FROST_BASE_URL + '/Datastreams', auth=frost_auth, json=datastream, timeout=TIMEOUT)
             if (q_res.status_code != 201):
                 print("Could not create Datastream " + datastream['name'])
                 print(q_res.text)
@@ -525,7 +607,7 @@ def update_thing(thing, cam):
 
     if changed:
         # Update Thing in Frost-Server
-        q_res = requests.patch(FROST_BASE_URL+'/Things('+str(thing['@iot.id'])+')', auth=frost_auth, json=updatedThing, timeout=TIMEOUT)
+        q_res = frost.patch(FROST_BASE_URL+'/Things('+str(thing['@iot.id'])+')', auth=frost_auth, json=updatedThing, timeout=TIMEOUT)
         if (q_res.status_code != 200):
             print(json.dumps(updatedThing, indent=4, sort_keys=True))
             print("Could not update Thing "+thing['name']+'('+str(thing['@iot.id'])+')')
@@ -556,7 +638,7 @@ def update_datastream(datastream, thing, cam):
 
     if changed:
         #Update Datastream in Frost-Server
-        q_res = requests.patch(FROST_BASE_URL+'/Datastreams('+str(datastream['@iot.id'])+')', auth=frost_auth, json=updatedDatastream, timeout=TIMEOUT)
+        q_res = frost.patch(FROST_BASE_URL+'/Datastreams('+str(datastream['@iot.id'])+')', auth=frost_auth, json=updatedDatastream, timeout=TIMEOUT)
         if (q_res.status_code != 200 and q_res.status_code != 201):
             print(json.dumps(updatedDatastream, indent=4, sort_keys=True))
             print("Could not update Datastream "+datastream['name']+'('+str(datastream['@iot.id'])+')')
@@ -564,24 +646,21 @@ def update_datastream(datastream, thing, cam):
         else:
             print("Updated Datastream "+datastream['name']+'('+str(datastream['@iot.id'])+')')
 
-def load_observations(datastream, starttime):
-    url = FROST_OBSERVATIONS.replace('<DATASTREAM_ID>', str(datastream['@iot.id'])).replace('<STARTTIME>', starttime.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+def load_observations(datastream, starttime, endtime=None):
+    if endtime is None:
+        url = FROST_OBSERVATIONS
+    else:
+        url = FROST_OBSERVATIONS_RANGE.replace('<ENDTIME>', endtime.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+    url = paged_url(url.replace('<DATASTREAM_ID>', str(datastream['@iot.id'])).replace('<STARTTIME>', starttime.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ")))
     results = []
-    r = requests.get(url, timeout=TIMEOUT)
+    r = frost.get(first_page_url(url), timeout=TIMEOUT)
     if (r.status_code == 200):
-        json_response = r.json()
+        json_response = json_codec.loads(r.content)
         if 'value' in json_response:
             results += json_response['value']
+            results += load_next_pages(url, json_response)
         else:
             results.append(json_response)
-        while '@iot.nextLink' in json_response:
-            r = requests.get(json_response['@iot.nextLink'], timeout=TIMEOUT)
-            if r.status_code != 200:
-                print(r.text)
-                print(str(r.status_code)+": "+r.json()['message'])
-                raise Exception("Could not load Data from Frost")
-            json_response = r.json()
-            results += json_response['value']
     else:
         print('Could not load Observations - '+str(r.status_code))
     observations = {}
@@ -601,7 +680,7 @@ def updateThingStatus(thing, status):
     updatedThing['properties']['status'] = status
 
     # Update Thing in Frost-Server
-    q_res = requests.patch(FROST_BASE_URL+'/Things('+str(thing['@iot.id'])+')', auth=frost_auth, json=updatedThing, timeout=TIMEOUT)
+    q_res = frost.patch(FROST_BASE_URL+'/Things('+str(thing['@iot.id'])+')', auth=frost_auth, json=updatedThing, timeout=TIMEOUT)
     if (q_res.status_code != 200):
         print(json.dumps(updatedThing, indent=4, sort_keys=True))
         print("Could not update Thing "+thing['name']+'('+str(thing['@iot.id'])+')')
@@ -624,40 +703,120 @@ def updateStatus():
 
 
 
-def import_observations(start, intervals):
+def import_observations(start, intervals, reopen=False):
+    run = WorkRun()
+    schedule_observations(run, start, intervals, reopen)
+    run.wait()
+
+def schedule_observations(run, start, intervals, reopen=False):
     start = UTC.localize(start.replace(hour=0, minute=0, second = 0, microsecond = 0, tzinfo=None))
     end = TIMEZONE.localize(datetime.datetime.now())
-    observations = []
-    for thing in things:
-        print(thing["properties"]["cameraId"])
-        data = load_api_data(start, end, thing["properties"]["cameraId"])
-        print(len(data))
+    # Intervals above one day get their own items, their buckets do not share range bounds
+    if max(INTERVAL_RANK[interval] for interval in intervals) > INTERVAL_RANK[INTERVAL_1_DAY]:
+        groups = [[interval] for interval in intervals]
+    else:
+        groups = [intervals]
+    for group in groups:
+        rank = min(INTERVAL_RANK[interval] for interval in group)
+        for index, (rangeStart, rangeEnd) in enumerate(split_range(start, end, group)):
+            priority = rank + (end - rangeEnd).total_seconds() / INTERVAL_1_DAY_DURATION.total_seconds()
+            for thing in things:
+                run.add()
+                work_queue.put(priority, thing["properties"]["cameraId"], {
+                    "run": run,
+                    "thing": thing,
+                    "intervals": group,
+                    "start": rangeStart,
+                    "end": rangeEnd,
+                    "reopen": reopen,
+                    "extend": index == 0
+                })
+
+def work():
+    # Items of one camera never run in parallel, their ranges and markers may overlap
+    while True:
+        cameraId, item = work_queue.get()
+        run = item["run"]
+        try:
+            if run.expired():
+                print("Skipped " + cameraId + " " + ",".join(item["intervals"]) + " " + item["start"].isoformat() + " - deadline exceeded")
+                run.done()
+                continue
+            import_thing_observations(item["thing"], item["intervals"], item["start"], item["end"], item["reopen"], item["extend"])
+            run.done()
+        except Exception as e:
+            traceback.print_exc()
+            run.done(e)
+        finally:
+            work_queue.done(cameraId)
+
+def import_thing_observations(thing, intervals, start, end, reopen, extend):
+    settled = datetime.datetime.now().astimezone(UTC) - SETTLE_TIME
+    # API days are inclusive, end is exclusive
+    lastTime = (end - datetime.timedelta(seconds=1)).astimezone(UTC)
+    resultTime = datetime.datetime.now().astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    print(thing["properties"]["cameraId"] + " " + ",".join(intervals) + " " + start.isoformat())
+    begins = {}
+    for datastream in thing["Datastreams"]:
+        if(datastream['properties']["periodLength"] in intervals):
+            begin = getOpenBegin(datastream, start, reopen, extend)
+            if begin <= lastTime:
+                begins[datastream['@iot.id']] = begin
+    if len(begins) == 0:
+        return
+    data = load_api_data(min(begins.values()), lastTime, thing["properties"]["cameraId"])
+    print(len(data))
+    finalized = []
+    def observations():
         for datastream in thing["Datastreams"]:
             #print("Datastream: "+str(datastream['@iot.id']))
-            if(datastream['properties']["periodLength"] in intervals):
-                observations += createAndUpdateObservations(thing, datastream, data, start, end)
-                if len(observations) >= 1000:
-                    post_observations(observations)
-                    observations = []
-    post_observations(observations)
-
-def createAndUpdateObservations(thing, datastream, data, start, end):
+            if datastream['@iot.id'] in begins:
+                yield from createAndUpdateObservations(thing, datastream, data, begins[datastream['@iot.id']], lastTime, resultTime)
+                finalizedUntil = getNewFinalizedUntil(datastream, begins[datastream['@iot.id']], end, settled, extend)
+                if finalizedUntil is not None:
+                    finalized.append((datastream, finalizedUntil))
+    # Raises if any write failed, then no datastream of this item is finalized
+    write_stream(observations(), post_observation_batch, OBSERVATION_QUEUE_SIZE, POST_BATCH_SIZE)
+    # Only finalize buckets once they are written
+    for datastream, finalizedUntil in finalized:
+        updateDatastreamFinalized(datastream, finalizedUntil)
+
+def updateDatastreamFinalized(datastream, finalizedUntil):
+    updatedDatastream = {'properties':datastream['properties']}
+    updatedDatastream['properties']['finalizedUntil'] = finalizedUntil.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    # Update Datastream in Frost-Server
+    q_res = frost.patch(FROST_BASE_URL+'/Datastreams('+str(datastream['@iot.id'])+')', auth=frost_auth, json=updatedDatastream, timeout=TIMEOUT)
+    if (q_res.status_code != 200):
+        print("Could not finalize Datastream "+datastream['name']+'('+str(datastream['@iot.id'])+')')
+        print(q_res.text)
+
+def post_observation_batch(observations):
+    if FROST_DATA_ARRAY:
+        post_data_array([observation for observation in observations if observation['method'] == 'post'])
+        post_observations([observation for observation in observations if observation['method'] != 'post'])
+    else:
+        post_observations(observations)
+
+def createAndUpdateObservations(thing, datastream, data, begin, end, resultTime):
+    # Readback and buckets of one work item are held in memory, only the created observations are streamed
     if datastream['properties']["measurement"] == "Anzahl":
-        return createAndUpdateObservationsCount(thing, datastream, data, start, end)
+        return createAndUpdateObservationsCount(thing, datastream, data, begin, end, resultTime)
     else:
-        return createAndUpdateObservationsSpeed(thing, datastream, data, start, end)
+        return createAndUpdateObservationsSpeed(thing, datastream, data, begin, end, resultTime)
 
-def createAndUpdateObservationsCount(thing, datastream, data, start, end):
+def createAndUpdateObservationsCount(thing, datastream, data, begin, end, resultTime):
     mot = datastream['properties']["vehicle"]
     zone = datastream['properties']['lane']
     interval = datastream['properties']["periodLength"]
-    begin = startOfStep(start, interval)
-    existingObservations = load_observations(datastream, begin)
+    existingObservations = load_observations(datastream, begin, getObservationsEnd(end, interval))
 
     results = {}
     for dataset in data:
         if thing["properties"]["cameraId"] == dataset["cameraId"] and (datastream["properties"]["lane"] == dataset["zoneName"] or datastream["properties"]["lane"]  == "MQ"):
             phenomenonTimeStart = startOfStep(UTC.localize(datetime.datetime.strptime(dataset["utc"], "%Y-%m-%dT%H:%M:%S.%fZ")), interval)
+            if phenomenonTimeStart < begin:
+                continue
             phenomenonTimeEnd = getEndTime(phenomenonTimeStart, interval)
             if not phenomenonTimeStart.isoformat() in results:
                 results[phenomenonTimeStart.isoformat()] = {
@@ -668,22 +827,19 @@ def createAndUpdateObservationsCount(thing, datastream, data, start, end):
             results[phenomenonTimeStart.isoformat()]["value"] += dataset[mot_count[mot]]
 
 
-    observations = []
     for result in results.values():
-        observation = create_or_update_observation(result, datastream, existingObservations)
+        observation = create_or_update_observation(result, datastream, existingObservations, resultTime)
         if not observation is None:
-            observations.append(observation)
-    return observations
+            yield observation
 
 
 
 
-def createAndUpdateObservationsSpeed(thing, datastream, data, start, end):
+def createAndUpdateObservationsSpeed(thing, datastream, data, begin, end, resultTime):
     mot = datastream['properties']["vehicle"]
     zone = datastream['properties']['lane']
     interval = datastream['properties']["periodLength"]
-    begin = startOfStep(start, interval)
-    existingObservations = load_observations(datastream, begin)
+    existingObservations = load_observations(datastream, begin, getObservationsEnd(end, interval))
 
     results = {}
     for dataset in data:
@@ -692,6 +848,8 @@ def createAndUpdateObservationsSpeed(thing, datastream, data, start, end):
             countValue = dataset[mot_count[mot]]
             if speedValue > -1:
                 phenomenonTimeStart = startOfStep(UTC.localize(datetime.datetime.strptime(dataset["utc"], "%Y-%m-%dT%H:%M:%S.%fZ")), interval)
+                if phenomenonTimeStart < begin:
+                    continue
                 phenomenonTimeEnd = getEndTime(phenomenonTimeStart, interval)
                 if not phenomenonTimeStart.isoformat() in results:
                     results[phenomenonTimeStart.isoformat()] = {
@@ -707,53 +865,17 @@ def createAndUpdateObservationsSpeed(thing, datastream, data, start, end):
                     results[phenomenonTimeStart.isoformat()]["value"] = round(results[phenomenonTimeStart.isoformat()]["speedSum"] / results[phenomenonTimeStart.isoformat()]["countSum"],2)
 
 
-    observations = []
     for result in results.values():
-        observation = create_or_update_observation(result, datastream, existingObservations)
+        observation = create_or_update_observation(result, datastream, existingObservations, resultTime)
         if not observation is None:
-            observations.append(observation)
-    return observations
-
-def startOfStep(time, step):
-    time = time.replace(second = 0, microsecond = 0)
-    if step == INTERVAL_5_MIN:
-        return time.replace(minute=math.floor(time.minute/5)*5)
-    if step == INTERVAL_1_HOUR:
-        return time.replace(minute=0)
-    if step == INTERVAL_1_DAY:
-        return TIMEZONE.localize(time.replace(hour=0, minute=0, tzinfo=None))
-    if step == INTERVAL_1_WEEK:
-        return TIMEZONE.localize((time - datetime.timedelta(days=time.weekday())).replace(hour=0, minute=0, tzinfo=None))
-    if step == INTERVAL_1_MONTH:
-        return TIMEZONE.localize(time.replace(day = 1, hour=0, minute=0, tzinfo=None))
-    if step == INTERVAL_1_YEAR:
-        return TIMEZONE.localize(time.replace(month = 1, day = 1, hour=0, minute=0, tzinfo=None))
-    return None
-
-def getEndTime(start, step):
-    if step == INTERVAL_5_MIN:
-        return start + INTERVAL_5_MIN_DURATION
-    if step == INTERVAL_1_HOUR:
-        return start + INTERVAL_1_HOUR_DURATION
-    if step == INTERVAL_1_DAY:
-        return start + INTERVAL_1_DAY_DURATION
-    if step == INTERVAL_1_WEEK:
-        return start + INTERVAL_1_WEEK_DURATION
-    if step == INTERVAL_1_MONTH:
-        if start.month < 12:
-            return start.replace(month=start.month+1)
-        else:
-            return start.replace(year=start.year+1, month=1)
-    if step == INTERVAL_1_YEAR:
-        return start.replace(year=start.year+1)
-    return None
+            yield observation
 
 def load_api_data(start, end, cam = ""):
     url = API_URL.replace('<FROM>', start.astimezone(UTC).strftime("%Y-%m-%d")).replace('<TO>', end.astimezone(UTC).strftime("%Y-%m-%d")).replace('<CAM_ID>', cam)
     results = []
     r = requests.get(url, auth=getToken(), timeout=TIMEOUT)
     if (r.status_code == 200):
-        return r.json()
+        return json_codec.loads(r.content)
     else:
         print('Could not load Data - '+str(r.status_code))
 
@@ -764,21 +886,34 @@ def post_observations(observations):
         observations = observations[len(observations)-500:]
     print('Observations: '+str(len(observations)))
     if len(observations) > 0:
-        r = requests.post(url=POST_URL, auth=frost_auth, json={"requests": observations}, headers={"Content-Type": "application/json;charset=UTF-8"}, timeout=TIMEOUT)
+        body, headers = json_codec.encode_body({"requests": observations}, FROST_GZIP_REQUESTS)
+        r = frost.post(url=POST_URL, auth=frost_auth, data=body, headers=headers, timeout=TIMEOUT)
         #print(str(r.status_code)+": "+r.text)
-        if (r.status_code != 200):
-            print("Could not save Observations")
-            print(str(r.status_code)+": "+r.text)
-        else:
-            json_response = r.json()
-            if 'responses' in json_response:
-                print(str(len(json_response['responses'])) + ' Responses')
-                for response in json_response['responses']:
-                    if response['status'] != 200 and response['status'] != 201:
-                        print(str(response['id']) + " (" + str(response['status']) + "): ") + response['body']
+        check_batch_response(r)
+
+def post_data_array(observations):
+    print('DataArray Observations: '+str(len(observations)))
+    if len(observations) == 0:
+        return
+    datastreams = {}
+    for observation in observations:
+        datastreamId = DATASTREAM_OBSERVATIONS_PATTERN.match(observation['url']).group(1)
+        datastreams.setdefault(datastreamId, []).append(observation)
+    data = []
+    for datastreamId, datastreamObservations in datastreams.items():
+        data.append({
+            "Datastream": {"@iot.id": int(datastreamId) if datastreamId.isdigit() else datastreamId},
+            "components": ["phenomenonTime", "resultTime", "result"],
+            "dataArray@iot.count": len(datastreamObservations),
+            "dataArray": [[observation['body']['phenomenonTime'], observation['body']['resultTime'], observation['body']['result']] for observation in datastreamObservations]
+        })
+    body, headers = json_codec.encode_body(data, FROST_GZIP_REQUESTS)
+    r = frost.post(url=CREATE_OBSERVATIONS_URL, auth=frost_auth, data=body, headers=headers, timeout=TIMEOUT)
+    entries = [observation for datastreamObservations in datastreams.values() for observation in datastreamObservations]
+    check_data_array_response(r, entries)
 
 def update_obersvation(observation):
-    q_res = requests.patch(FROST_BASE_URL+'/Observations('+str(observation['@iot.id'])+')', auth=frost_auth, json=observation, timeout=TIMEOUT)
+    q_res = frost.patch(FROST_BASE_URL+'/Observations('+str(observation['@iot.id'])+')', auth=frost_auth, json=observation, timeout=TIMEOUT)
     if (q_res.status_code != 200):
         print("Could not update Observation "+observation['phenomenonTime']+'('+str(observation['@iot.id'])+')')
         print(q_res.text)
@@ -786,7 +921,7 @@ def update_obersvation(observation):
         print("Updated Observation "+observation['phenomenonTime']+'('+str(observation['@iot.id'])+')')
 
 
-def create_or_update_observation(result, datastream, observations):
+def create_or_update_observation(result, datastream, observations, resultTime):
     isoDateStart = result["phenomenonTimeStart"]
     isoDateEnd = result["phenomenonTimeEnd"]
     phenomenonTime = isoDateStart.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")+'/'+isoDateEnd.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -797,7 +932,7 @@ def create_or_update_observation(result, datastream, observations):
             observation = {
                 "@iot.id" : observation['@iot.id'],
                 "phenomenonTime": observation['phenomenonTime'],
-                "resultTime": datetime.datetime.now().astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "resultTime": resultTime,
                 "result": result['value']
             }
             #update_obersvation(observation)
@@ -816,7 +951,7 @@ def create_or_update_observation(result, datastream, observations):
             "url": 'Datastreams('+str(datastream['@iot.id'])+')/Observations',
             "body": {
                 "phenomenonTime": phenomenonTime,
-                "resultTime": datetime.datetime.now().astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "resultTime": resultTime,
                 "result": result['value']
             }
         }
@@ -824,22 +959,40 @@ def create_or_update_observation(result, datastream, observations):
 @sched.scheduled_job('cron',minute="8")
 def run_import():
     init_things()
-    import_observations(datetime.datetime.now()-datetime.timedelta(hours=4), [INTERVAL_5_MIN, INTERVAL_1_HOUR])
-    import_observations(datetime.datetime.now()-datetime.timedelta(days=2), [INTERVAL_1_DAY])
-    updateStatus()
+    # Work not started before the next hourly run is skipped, the next run covers it again
+    run = WorkRun(time.monotonic() + RUN_DEADLINE.total_seconds())
+    schedule_observations(run, datetime.datetime.now()-datetime.timedelta(hours=4), [INTERVAL_5_MIN, INTERVAL_1_HOUR])
+    schedule_observations(run, datetime.datetime.now()-datetime.timedelta(days=2), [INTERVAL_1_DAY])
+    try:
+        run.wait()
+    finally:
+        updateStatus()
 
 @sched.scheduled_job('cron',hour="0", minute="32")
 def run_import_long():
     import_observations(datetime.datetime(year=2023, month=12, day=30), [INTERVAL_1_WEEK, INTERVAL_1_MONTH, INTERVAL_1_YEAR])
 
 
-def import_archive():
+def import_archive(start=datetime.datetime(year=2023, month=12, day=20)):
+    # Backfill, finalized buckets are reopened
     init_things()
-    import_observations(datetime.datetime(year=2023, month=12, day=20), [INTERVAL_5_MIN, INTERVAL_1_HOUR, INTERVAL_1_DAY, INTERVAL_1_WEEK, INTERVAL_1_MONTH, INTERVAL_1_YEAR])
-    updateStatus()
+    run = WorkRun()
+    schedule_observations(run, start, [INTERVAL_5_MIN, INTERVAL_1_HOUR, INTERVAL_1_DAY], reopen=True)
+    schedule_observations(run, start, [INTERVAL_1_WEEK, INTERVAL_1_MONTH, INTERVAL_1_YEAR], reopen=True)
+    try:
+        run.wait()
+    finally:
+        updateStatus()
 
 init()
 
+for i in range(IMPORT_WORKERS):
+    threading.Thread(target=work, daemon=True).start()
+
+if BACKFILL_START:
+    # Runs beside the scheduler, scheduled imports take precedence in the work queue
+    threading.Thread(target=import_archive, args=(datetime.datetime.strptime(BACKFILL_START, "%Y-%m-%d"),)).start()
+
 #import_archive()
 #run_import()
 #run_import_long()
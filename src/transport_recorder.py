@@ -0,0 +1,113 @@
+import re
+import gzip
+import json
+import time
+import base64
+import hashlib
+import datetime
+import threading
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# Dates and timestamps, also URL encoded, differ between runs
+TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}((T|%20| )\d{2}(:|%3A)\d{2}(:|%3A)\d{2}(\.\d+)?(Z|[+-]\d{2}(:|%3A)\d{2})?)?')
+
+send = HTTPAdapter.send
+lock = threading.Lock()
+
+def normalize(text):
+    return TIMESTAMP_PATTERN.sub('<TIME>', text)
+
+def request_key(request):
+    body = request.body or b''
+    if isinstance(body, bytes) and body[:2] == b'\x1f\x8b':
+        body = gzip.decompress(body)
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    return request.method + ' ' + normalize(request.url) + ' ' + hashlib.sha1(normalize(body).encode('utf-8')).hexdigest()
+
+class Recorder:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+
+    def send(self, adapter, request, **kwargs):
+        start = time.monotonic()
+        response = send(adapter, request, **kwargs)
+        content = response.content
+        exchange = {
+            "key": request_key(request),
+            "method": request.method,
+            "url": request.url,
+            "status": response.status_code,
+            "headers": dict(response.headers),
+            "body": base64.b64encode(content).decode('ascii'),
+            "elapsed": time.monotonic() - start
+        }
+        self.write(exchange)
+        return response
+
+    def write(self, exchange):
+        # Every exchange is a complete gzip member, the file stays readable if the process is killed
+        member = gzip.compress((json.dumps(exchange) + '\n').encode('utf-8'), compresslevel=5)
+        with lock:
+            self.file.write(member)
+            self.file.flush()
+
+class Replayer:
+    def __init__(self, path, simulate_latency):
+        self.simulate_latency = simulate_latency
+        self.by_key = {}
+        count = 0
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                for line in file:
+                    exchange = json.loads(line)
+                    self.by_key.setdefault(exchange["key"], deque()).append(exchange)
+                    count += 1
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            # The last exchange was cut off when the recording process was killed
+            print("Recording truncated after " + str(count) + " exchanges")
+
+    def next_exchange(self, request):
+        # Equal requests are served in recorded order
+        with lock:
+            exchanges = self.by_key.get(request_key(request))
+            if exchanges:
+                return exchanges.popleft()
+        return None
+
+    def send(self, adapter, request, **kwargs):
+        exchange = self.next_exchange(request)
+        if exchange is None:
+            raise requests.exceptions.ConnectionError('No recorded response for ' + request.method + ' ' + request.url, request=request)
+        if self.simulate_latency:
+            time.sleep(exchange["elapsed"])
+        response = requests.Response()
+        response.status_code = exchange["status"]
+        response.headers = CaseInsensitiveDict(exchange["headers"])
+        # Body is stored decoded
+        response.headers.pop('Content-Encoding', None)
+        response.headers.pop('Content-Length', None)
+        response._content = base64.b64decode(exchange["body"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=exchange["elapsed"])
+        response.connection = adapter
+        return response
+
+def install(mode, path, simulate_latency=False):
+    # Intercepts every request sent through requests, including the Keycloak client
+    if mode == MODE_RECORD:
+        transport = Recorder(path)
+    elif mode == MODE_REPLAY:
+        transport = Replayer(path, simulate_latency)
+    else:
+        raise Exception('Unknown transport mode ' + str(mode))
+    HTTPAdapter.send = lambda adapter, request, **kwargs: transport.send(adapter, request, **kwargs)
+    print("Transport " + mode + ": " + path)
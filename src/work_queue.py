@@ -0,0 +1,73 @@
+import time
+import heapq
+import itertools
+import threading
+
+class WorkQueue:
+    def __init__(self, aging):
+        # aging: priority units an item gains per second of waiting
+        self.aging = aging
+        self.heap = []
+        self.busy = set()
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def put(self, priority, key, item):
+        # Aging is the same for all items, so the effective order is fixed when the item is added
+        order = priority + self.aging * time.monotonic()
+        with self.condition:
+            heapq.heappush(self.heap, (order, next(self.counter), key, item))
+            self.condition.notify_all()
+
+    def get(self):
+        # Returns the first item whose key is not in work, the key stays busy until done(key)
+        with self.condition:
+            while True:
+                skipped = []
+                entry = None
+                while len(self.heap) > 0:
+                    entry = heapq.heappop(self.heap)
+                    if entry[2] not in self.busy:
+                        break
+                    skipped.append(entry)
+                    entry = None
+                for skippedEntry in skipped:
+                    heapq.heappush(self.heap, skippedEntry)
+                if entry is not None:
+                    self.busy.add(entry[2])
+                    return entry[2], entry[3]
+                self.condition.wait()
+
+    def done(self, key):
+        with self.condition:
+            self.busy.discard(key)
+            self.condition.notify_all()
+
+class WorkRun:
+    def __init__(self, deadline=None):
+        # deadline in time.monotonic(), items not started before it are skipped
+        self.deadline = deadline
+        self.pending = 0
+        self.errors = []
+        self.condition = threading.Condition()
+
+    def add(self):
+        with self.condition:
+            self.pending += 1
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def done(self, error=None):
+        with self.condition:
+            if error is not None:
+                self.errors.append(error)
+            self.pending -= 1
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            while self.pending > 0:
+                self.condition.wait()
+        if len(self.errors) > 0:
+            raise self.errors[0]
@@ -0,0 +1,48 @@
+import json
+import pytest
+import requests
+
+from observation_writer import write_stream, check_batch_response, check_data_array_response
+
+def response(status, body):
+    r = requests.Response()
+    r.status_code = status
+    r._content = json.dumps(body).encode('utf-8')
+    return r
+
+def observation(i):
+    return {"id": str(i), "method": "post", "url": "Datastreams(1)/Observations", "body": {}}
+
+def test_failed_write_stops_finalizing():
+    posted = []
+    finalized = []
+    def post(batch):
+        posted.append(len(batch))
+        if len(posted) == 2:
+            check_batch_response(response(503, {"message": "Service Unavailable"}))
+    def observations():
+        for datastream in range(3):
+            yield from [observation(i) for i in range(5)]
+            finalized.append(datastream)
+    with pytest.raises(Exception):
+        write_stream(observations(), post, 2, 5)
+    # No batch is posted after the failed one, the import does not get past write_stream to finalize
+    assert posted == [5, 5]
+
+def test_successful_write():
+    posted = []
+    write_stream((observation(i) for i in range(12)), lambda batch: posted.extend(batch), 4, 5)
+    assert len(posted) == 12
+
+def test_failed_batch_entry_raises():
+    with pytest.raises(Exception):
+        check_batch_response(response(200, {"responses": [{"id": "1", "status": 201, "body": {}}, {"id": "2", "status": 400, "body": "Invalid"}]}))
+    check_batch_response(response(200, {"responses": [{"id": "1", "status": 201, "body": {}}]}))
+
+def test_failed_data_array_entry_raises():
+    entries = [observation(1), observation(2)]
+    with pytest.raises(Exception):
+        check_data_array_response(response(201, ["http://frost/v1.1/Observations(7)", "error"]), entries)
+    with pytest.raises(Exception):
+        check_data_array_response(response(503, {}), entries)
+    check_data_array_response(response(201, ["http://frost/v1.1/Observations(7)", "http://frost/v1.1/Observations(8)"]), entries)
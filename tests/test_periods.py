@@ -0,0 +1,83 @@
+import datetime
+
+from periods import INTERVAL_5_MIN, INTERVAL_1_HOUR, INTERVAL_1_DAY, INTERVAL_1_WEEK, INTERVAL_1_MONTH, TIMEZONE, UTC
+from periods import startOfStep, split_range, getFinalizedUntil, getOpenBegin, getNewFinalizedUntil
+
+SETTLE_TIME = datetime.timedelta(hours=4)
+
+def run_hourly(datastreams, now, lookback, intervals, imported=None):
+    # Mirrors schedule_observations/import_thing_observations, ranges run newest first like the work queue
+    start = UTC.localize((now - lookback).replace(hour=0, minute=0, second=0, microsecond=0))
+    end = TIMEZONE.localize(now)
+    settled = end.astimezone(UTC) - SETTLE_TIME
+    ranges = list(enumerate(split_range(start, end, intervals)))
+    for index, (rangeStart, rangeEnd) in reversed(ranges):
+        lastTime = (rangeEnd - datetime.timedelta(seconds=1)).astimezone(UTC)
+        for datastream in datastreams:
+            if datastream['properties']['periodLength'] not in intervals:
+                continue
+            begin = getOpenBegin(datastream, rangeStart, False, index == 0)
+            if begin > lastTime:
+                continue
+            if imported is not None:
+                imported.append((begin, lastTime))
+            finalizedUntil = getNewFinalizedUntil(datastream, begin, rangeEnd, settled, index == 0)
+            if finalizedUntil is not None:
+                datastream['properties']['finalizedUntil'] = finalizedUntil.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return settled
+
+def datastream(interval):
+    return {'properties': {'periodLength': interval}}
+
+def test_hourly_markers_advance_across_midnight():
+    datastreams = [datastream(INTERVAL_5_MIN), datastream(INTERVAL_1_HOUR), datastream(INTERVAL_1_DAY)]
+    for hour in range(48):
+        now = datetime.datetime(2026, 10, 9, 0, 8) + datetime.timedelta(hours=hour)
+        settled = run_hourly(datastreams, now, datetime.timedelta(hours=4), [INTERVAL_5_MIN, INTERVAL_1_HOUR])
+        run_hourly(datastreams, now, datetime.timedelta(days=2), [INTERVAL_1_DAY])
+        for ds in datastreams:
+            interval = ds['properties']['periodLength']
+            expected = startOfStep(settled, interval).astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+            assert ds['properties']['finalizedUntil'] == expected, (now, interval)
+
+def test_nightly_run_imports_every_range_of_new_datastream():
+    ds = datastream(INTERVAL_1_WEEK)
+    for night in range(21):
+        now = datetime.datetime(2026, 9, 1, 0, 32) + datetime.timedelta(days=night)
+        finalizedUntil = getFinalizedUntil(ds)
+        imported = []
+        settled = run_hourly([ds], now, now - datetime.datetime(2023, 12, 30), [INTERVAL_1_WEEK], imported)
+        # The imported ranges reach without gaps from the last marker, or the run's start, to now
+        imported.sort()
+        if finalizedUntil is None:
+            assert imported[0][0] <= UTC.localize(datetime.datetime(2023, 12, 30)), now
+        else:
+            assert imported[0][0] <= finalizedUntil, now
+        for (begin, lastTime), (nextBegin, nextLastTime) in zip(imported, imported[1:]):
+            assert nextBegin <= lastTime + datetime.timedelta(seconds=1), now
+        assert imported[-1][1] >= TIMEZONE.localize(now) - datetime.timedelta(seconds=1)
+        assert getFinalizedUntil(ds) <= startOfStep(settled, INTERVAL_1_WEEK)
+
+def test_open_begin_covers_gap_after_outage():
+    ds = datastream(INTERVAL_5_MIN)
+    ds['properties']['finalizedUntil'] = "2026-10-05T10:05:00Z"
+    start = UTC.localize(datetime.datetime(2026, 10, 9))
+    assert getOpenBegin(ds, start, False, True) == UTC.localize(datetime.datetime(2026, 10, 5, 10, 5))
+    assert getOpenBegin(ds, start, False, False) == start
+    assert getOpenBegin(ds, start, True, True) == start
+
+def test_open_begin_skips_finalized_buckets():
+    ds = datastream(INTERVAL_1_HOUR)
+    ds['properties']['finalizedUntil'] = "2026-10-09T06:00:00Z"
+    start = UTC.localize(datetime.datetime(2026, 10, 9))
+    assert getOpenBegin(ds, start, False, False) == UTC.localize(datetime.datetime(2026, 10, 9, 6))
+
+def test_split_range_follows_coarse_buckets():
+    start = UTC.localize(datetime.datetime(2023, 12, 30))
+    end = TIMEZONE.localize(datetime.datetime(2024, 3, 10, 12))
+    ranges = split_range(start, end, [INTERVAL_1_MONTH])
+    assert [rangeStart.strftime("%Y-%m-%d") for rangeStart, rangeEnd in ranges] == ["2023-12-30", "2024-01-01", "2024-02-01", "2024-03-01"]
+    assert ranges[-1][1] == end
+    weeks = split_range(start, end, [INTERVAL_1_WEEK])
+    assert weeks[1][0] == UTC.localize(datetime.datetime(2024, 1, 1))
+    assert all(rangeStart.weekday() == 0 for rangeStart, rangeEnd in weeks[1:])
@@ -0,0 +1,36 @@
+import pytest
+
+from leader_lock import FileLock, StaticLock
+from sharding import check_shard_config, shard_of
+
+def test_only_one_file_lock_is_leader(tmp_path):
+    path = str(tmp_path / 'leader.lock')
+    first = FileLock(path)
+    second = FileLock(path)
+    assert first.acquire()
+    assert not second.acquire()
+    # The leader keeps its lock
+    assert first.acquire()
+    first.file.close()
+    assert second.acquire()
+
+def test_static_lock():
+    assert StaticLock(True).acquire()
+    assert not StaticLock(False).acquire()
+
+def test_every_camera_has_exactly_one_shard():
+    cameraIds = ['cam-' + str(i) for i in range(200)]
+    shards = [shard_of(cameraId, 3) for cameraId in cameraIds]
+    assert all(0 <= shard < 3 for shard in shards)
+    # Deterministic and spread over all shards
+    assert shards == [shard_of(cameraId, 3) for cameraId in cameraIds]
+    assert all(shards.count(shard) > 40 for shard in range(3))
+
+@pytest.mark.parametrize("shard_count, shard_index", [(0, 0), (2, 2), (2, -1)])
+def test_invalid_shard_config(shard_count, shard_index):
+    with pytest.raises(Exception):
+        check_shard_config(shard_count, shard_index)
+
+def test_valid_shard_config():
+    check_shard_config(1, 0)
+    check_shard_config(4, 3)
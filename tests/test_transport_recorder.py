@@ -0,0 +1,34 @@
+from transport_recorder import Recorder, Replayer
+
+def exchange(i):
+    return {
+        "key": "GET http://frost/Things(" + str(i) + ") da39a3ee5e6b4b0d3255bfef95601890afd80709",
+        "method": "GET",
+        "url": "http://frost/Things(" + str(i) + ")",
+        "status": 200,
+        "headers": {},
+        "body": "",
+        "elapsed": 0.0
+    }
+
+def test_recording_is_readable_without_close(tmp_path):
+    path = str(tmp_path / 'transport.jsonl.gz')
+    recorder = Recorder(path)
+    for i in range(3):
+        recorder.write(exchange(i))
+    # No close, like a process stopped by SIGTERM
+    replayer = Replayer(path, False)
+    assert sum(len(exchanges) for exchanges in replayer.by_key.values()) == 3
+
+def test_truncated_recording_keeps_complete_exchanges(tmp_path):
+    path = str(tmp_path / 'transport.jsonl.gz')
+    recorder = Recorder(path)
+    for i in range(3):
+        recorder.write(exchange(i))
+    recorder.file.close()
+    with open(path, 'rb') as file:
+        content = file.read()
+    with open(path, 'wb') as file:
+        file.write(content[:-10])
+    replayer = Replayer(path, False)
+    assert sum(len(exchanges) for exchanges in replayer.by_key.values()) == 2
@@ -0,0 +1,36 @@
+import pytest
+
+from work_queue import WorkQueue, WorkRun
+
+def test_lower_priority_first():
+    queue = WorkQueue(0)
+    queue.put(900, "cam1", "backfill")
+    queue.put(5, "cam2", "year")
+    queue.put(0, "cam3", "fresh")
+    assert [queue.get()[1] for i in range(3)] == ["fresh", "year", "backfill"]
+
+def test_waiting_items_gain_priority():
+    queue = WorkQueue(1)
+    queue.put(10, "cam1", "old")
+    # An item added later with the same priority goes after the waiting one
+    queue.put(10, "cam2", "new")
+    assert queue.get()[1] == "old"
+
+def test_busy_camera_is_skipped():
+    queue = WorkQueue(0)
+    queue.put(0, "cam1", "first")
+    queue.put(1, "cam1", "second")
+    queue.put(2, "cam2", "other")
+    assert queue.get() == ("cam1", "first")
+    assert queue.get() == ("cam2", "other")
+    queue.done("cam1")
+    assert queue.get() == ("cam1", "second")
+
+def test_run_raises_first_error():
+    run = WorkRun()
+    run.add()
+    run.add()
+    run.done()
+    run.done(ValueError("failed"))
+    with pytest.raises(ValueError):
+        run.wait()